@@ -0,0 +1,314 @@
+"""
+Batch runner
+
+A Python program to run Euler deconvolution without a display over many
+grid files, listed with their parameters in a job manifest. The jobs are
+shared by a pool of processes; each process loads the grid of its next job
+while it computes the current one. The results of each job are saved in
+its own folder and a summary of all the jobs in 'batch.json'.
+matplotlib is imported only if some job asks for figures.
+
+The manifest is a JSON file with the parameters shared by the jobs and
+the list of the jobs, that can override any of them:
+
+    {"defaults": {"SI": [0.001, 1, 2, 3], "winsize": 7, "filt": 0.1},
+     "jobs": [{"name": "synthetic",
+               "grid": "input/synthetic_data.grd",
+               "areas": [[0, 25000, 24000, 28000]],
+               "cluster_cell": 1000.0,
+               "figures": true}]}
+
+    - grid: binary grid file (.grd, see grid_io.py) or 4-column text file,
+      relative to the folder of the manifest. The windows out of the mask
+      of a grid interpolated from scattered samples (see gridding.py) are
+      not solved
+    - name: name of the folder of the results. Default: name of the grid
+    - SI, winsize, filt: structural indices, size of the moving data
+      window and percentage of the solutions kept
+    - areas: areas of the statistics of the estimates (classic_areas.txt)
+    - cluster_cell, min_points: clusters of the estimates
+      (classic_clusters*.txt)
+    - dtype: precision of the computation, 'float64' or 'float32'
+    - criterion: criterion of the selection of the estimates, 'stdz',
+      'amplitude', 'depth_error' or a list of them (see
+      euler_python.euler_deconv_multi)
+    - figures: save the Figures 4 and 7 of the estimates
+    - store: save the solutions of all the windows in the folder
+      'solutions' of the job, to select the estimates again later (see
+      solution_store.py)
+
+Run 'python batch_runner.py -h' for the options.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import euler_python as euler
+import estimates_statistics as est_stats
+import estimates_clustering as est_clust
+import grid_io
+
+#parameters of the jobs that are not given in the manifest
+DEFAULTS={'SI':[0.001,1,2,3], 'winsize':7, 'filt':0.1, 'areas':None,
+          'cluster_cell':None, 'min_points':5, 'dtype':'float64',
+          'criterion':'stdz',
+          'figures':False, 'store':False}
+
+def read_manifest(fname):
+    """
+    Read a job manifest.
+
+    Parameters:
+
+    * fname : str
+        name of the JSON manifest
+
+    Returns:
+
+    * jobs : list of dict
+        the parameters of each job, completed with the defaults
+    """
+    with open(fname) as fid:
+        manifest=json.load(fid)
+    folder=os.path.dirname(os.path.abspath(fname))
+    defaults=dict(DEFAULTS,**manifest.get('defaults',{}))
+    jobs=[]
+    names=set()
+    for k,job in enumerate(manifest['jobs']):
+        job=dict(defaults,**job)
+        if 'grid' not in job:
+            raise ValueError("job %d of '%s' has no grid" % (k,fname))
+        job['grid']=os.path.join(folder,job['grid'])
+        job.setdefault('name',
+                       os.path.splitext(os.path.basename(job['grid']))[0])
+        if job['name'] in names:
+            raise ValueError("two jobs of '%s' are named '%s'" %
+                             (fname,job['name']))
+        names.add(job['name'])
+        jobs.append(job)
+    return jobs
+
+def load_job(job):
+    """
+    Load the grid of a job into memory.
+
+    Parameters:
+
+    * job : dict
+        the parameters of the job
+
+    Returns:
+
+    * data, xi, yi, zi : array
+        the input data set and the coordinates
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    * mask : 2d-array
+        True at the grid nodes covered by samples, for grids interpolated
+        from scattered samples (see gridding.py). None if the grid has no
+        mask
+    """
+    mask=None
+    if job['grid'].endswith('.grd'):
+        data,xi,yi,zi,shape,area=grid_io.load_grid(job['grid'])
+        # read the memory-mapped grids now, not during the computation
+        data,zi=np.array(data),np.array(zi)
+        if isinstance(xi,np.memmap):
+            xi,yi=np.array(xi),np.array(yi)
+        mask=grid_io.load_mask(job['grid'])
+        if mask is not None:
+            mask=np.array(mask)
+    else:
+        xi,yi,zi,data=np.loadtxt(job['grid']).T
+        shape,area=grid_io.grid_geometry(xi,yi)
+    return data,xi,yi,zi,shape,area,mask
+
+def run_job(job,grid,output):
+    """
+    Euler deconvolution of one job, with its results saved in the folder
+    'output/name': the estimates of each SI (estimates_SI_*.txt) and, if
+    asked in the job, the statistics of the areas, the clusters and the
+    figures.
+
+    Parameters:
+
+    * job : dict
+        the parameters of the job
+    * grid : tuple
+        the grid loaded by load_job
+    * output : str
+        folder of the results of all the jobs
+
+    Returns:
+
+    * record : dict
+        time of each stage, counters and number of estimates of each SI
+    """
+    folder=os.path.join(output,job['name'])
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    data,xi,yi,zi,shape,area,mask=grid
+    SI_vet=job['SI']
+    stats=euler.EulerStats()
+    store=os.path.join(folder,'solutions') if job['store'] else None
+    est_classic=euler.euler_deconv_multi(data,xi,yi,zi,shape,area,SI_vet,
+                                         job['winsize'],job['filt'],
+                                         stats=stats,
+                                         dtype=np.dtype(job['dtype']),
+                                         mask=mask,store=store,
+                                         criterion=job['criterion'])
+    for SI,est in zip(SI_vet,est_classic):
+        np.savetxt(os.path.join(folder,'estimates_SI_%g.txt' % SI),est,
+                   fmt='%.3f',header="x, y, z, base level",comments='')
+    if job['areas']:
+        est_stats.classic_areas(est_classic,job['areas'],SI_vet,
+                                'classic_areas',folder)
+    if job['cluster_cell']:
+        est_clust.classic_clusters(est_classic,SI_vet,job['cluster_cell'],
+                                   job['min_points'],'classic_clusters',
+                                   folder)
+    if job['figures']:
+        import matplotlib
+        matplotlib.use('Agg')
+        import plot_functions as plt_fc
+        plt_fc.plot_classic_fast(data,est_classic,xi,yi,zi,shape,
+                                 folder=folder,annotate=False)
+    return {'times':stats.times, 'counts':stats.counts,
+            'estimates':[len(est) for est in est_classic]}
+
+def _run_loaded(job,loading,output):
+    """
+    Run a job whose grid is being loaded, recording its failure instead of
+    stopping the batch.
+    """
+    start=time.perf_counter()
+    record={'name':job['name'], 'grid':job['grid']}
+    try:
+        record.update(run_job(job,loading.result(),output))
+        record['status']='done'
+    except Exception:
+        record['status']='failed'
+        record['error']=traceback.format_exc()
+    record['seconds']=time.perf_counter() - start
+    return record
+
+def _worker(tasks,results,output):
+    """
+    Run the jobs of the queue tasks until a None is found, and put their
+    records in the queue results. The grid of the next job is loaded in a
+    thread while the current job is computed.
+    """
+    loader=ThreadPoolExecutor(1)
+    try:
+        job=tasks.get()
+        loading=loader.submit(load_job,job) if job is not None else None
+        while job is not None:
+            following=tasks.get()
+            if following is not None:
+                following_loading=loader.submit(load_job,following)
+            else:
+                following_loading=None
+            results.put(_run_loaded(job,loading,output))
+            job,loading=following,following_loading
+    finally:
+        loader.shutdown()
+
+def run_batch(jobs,output,workers=1):
+    """
+    Run all the jobs in a pool of processes and save the summary in
+    'output/batch.json'.
+
+    Parameters:
+
+    * jobs : list of dict
+        the parameters of each job - see read_manifest
+    * output : str
+        folder of the results
+    * workers : int
+        number of processes. With 1, the jobs run in this process
+
+    Returns:
+
+    * records : list of dict
+        status, time and results of each job, in the order of jobs
+    """
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    if workers <= 1:
+        tasks,results=queue.Queue(),queue.Queue()
+        processes=[]
+    else:
+        import multiprocessing
+        tasks,results=multiprocessing.Queue(),multiprocessing.Queue()
+    for job in jobs:
+        tasks.put(job)
+    for k in range(max(workers,1)):
+        tasks.put(None)
+    if workers <= 1:
+        _worker(tasks,results,output)
+    else:
+        processes=[multiprocessing.Process(target=_worker,
+                                           args=(tasks,results,output))
+                   for k in range(workers)]
+        for process in processes:
+            process.start()
+
+    records={}
+    while len(records) < len(jobs):
+        try:
+            record=results.get(timeout=1.)
+        except queue.Empty:
+            # the workers died without finishing the jobs
+            if not any(process.is_alive() for process in processes):
+                break
+            continue
+        records[record['name']]=record
+        print('%-30s %-6s %8.2f s' % (record['name'],record['status'],
+                                      record['seconds']))
+    for process in processes:
+        process.join()
+    records=[records.get(job['name'],{'name':job['name'],
+                                      'grid':job['grid'],
+                                      'status':'lost'}) for job in jobs]
+    with open(os.path.join(output,'batch.json'),'w') as fid:
+        json.dump(records,fid,indent=1)
+    return records
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Euler deconvolution of the '
+                                   'grids of a job manifest')
+    parser.add_argument('manifest',help='JSON file with the jobs')
+    parser.add_argument('--output',default='results/batch',
+                        help='folder of the results of the jobs')
+    parser.add_argument('--workers',type=int,default=1,
+                        help='number of processes')
+    parser.add_argument('--figures',action='store_true',
+                        help='save the figures of all the jobs')
+    args=parser.parse_args()
+
+    jobs=read_manifest(args.manifest)
+    if args.figures:
+        for job in jobs:
+            job['figures']=True
+    records=run_batch(jobs,args.output,args.workers)
+    failed=[record['name'] for record in records
+            if record['status'] != 'done']
+    if failed:
+        sys.exit('failed jobs: ' + ', '.join(failed))
@@ -0,0 +1,253 @@
+"""
+Benchmark
+
+A Python program to measure the time and the peak memory of the public
+functions of Euler deconvolution - deriv, euler_deconv,
+euler_deconv_multi and the statistics of the estimates - on synthetic
+grids of increasing size, for several window sizes, percentages of
+solutions kept and numbers of structural indices, in double or single
+precision. With --stages, the stages inside euler_deconv_multi
+(derivatives, window sums, solution of the systems and selection of the
+reliable estimates) are also measured one by one.
+
+The results are saved in a JSON file, with one record per grid size,
+parameters and function or stage, to compare versions of the code. Run
+'python benchmark.py -h' for the options.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import euler_python as euler
+import estimates_statistics as est_stats
+
+def synthetic_grid(n,spacing=100.):
+    """
+    Synthetic total-field anomaly of point sources on a square grid.
+
+    Parameters:
+
+    * n : int
+        number of grid nodes in each direction
+    * spacing : float
+        distance between the grid nodes
+
+    Returns:
+
+    * data, xi, yi, zi : 1d-array
+        the anomaly and the coordinates of the grid nodes
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    """
+    shape=(n,n)
+    area=[0.,(n - 1)*spacing,0.,(n - 1)*spacing]
+    xs=np.linspace(area[0],area[1],n)
+    xi,yi=np.meshgrid(xs,xs,indexing='ij')
+    zi=-100.*np.ones_like(xi)
+    rng=np.random.RandomState(0)
+    data=np.zeros_like(xi)
+    #a fixed density of sources, so the field looks the same at any size
+    for k in range(max(4,n*n//20000)):
+        x0,y0=rng.uniform(area[0],area[1],2)
+        z0=rng.uniform(2,10)*spacing
+        r2=(xi - x0)**2 + (yi - y0)**2 + (zi - z0)**2
+        data+=1e9*(z0 - zi)/r2**1.5
+    data+=rng.normal(0.,0.01*data.std(),shape)
+    return data.ravel(),xi.ravel(),yi.ravel(),zi.ravel(),shape,area
+
+def measure(func,repeat):
+    """
+    Best wall time of a number of runs of a function, and the peak of
+    memory allocated in one more run.
+
+    Parameters:
+
+    * func : function
+        the stage to measure, without arguments
+    * repeat : int
+        number of timed runs
+
+    Returns:
+
+    * result : any
+        the value returned by func
+    * seconds : float
+        the best wall time
+    * peak : int
+        the peak of memory allocated, in bytes
+    """
+    seconds=np.inf
+    for k in range(repeat):
+        start=time.perf_counter()
+        func()
+        seconds=min(seconds,time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        result=func()
+        peak=tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result,seconds,peak
+
+def run(sizes,winsizes,filts,nsis,repeat,dtype=np.float64,stages=False):
+    """
+    Run the benchmark over all the combinations of the parameters, in the
+    precision dtype. The public functions are measured as the workflow
+    calls them: euler_python.deriv, euler_python.euler_deconv for each SI,
+    euler_python.euler_deconv_multi and estimates_statistics.classic.
+
+    Parameters:
+
+    * stages : bool
+        also measure the stages inside euler_deconv_multi one by one -
+        see _run_stages
+
+    Returns:
+
+    * records : list of dict
+        time and peak memory of each public function ('call') and of
+        each stage ('stage')
+    """
+    SI_all=[0.001,1,2,3,0.5,1.5,2.5,3.5]
+    records=[]
+    workdir=tempfile.mkdtemp()
+    cwd=os.getcwd()
+    os.mkdir(os.path.join(workdir,'results'))
+    os.chdir(workdir)
+    try:
+        for n in sizes:
+            data,xi,yi,zi,shape,area=synthetic_grid(n)
+            size={'size':n, 'dtype':np.dtype(dtype).name}
+            grid=data.reshape(shape)
+            _,t,m=measure(lambda: euler.deriv(grid,shape,area,dtype=dtype),
+                          repeat)
+            records.append(dict(size,call='deriv',time=t,peak_memory=m))
+            for winsize in winsizes:
+                for nsi in nsis:
+                    SI_vet=SI_all[:nsi]
+                    for filt in filts:
+                        param=dict(size,winsize=winsize,nsi=nsi,filt=filt)
+                        _,t,m=measure(lambda: [euler.euler_deconv(
+                            data,xi,yi,zi,shape,area,SI,winsize,filt,
+                            dtype=dtype) for SI in SI_vet],repeat)
+                        records.append(dict(param,call='euler_deconv',time=t,
+                                            peak_memory=m))
+                        est_classic,t,m=measure(
+                            lambda: euler.euler_deconv_multi(
+                                data,xi,yi,zi,shape,area,SI_vet,winsize,filt,
+                                dtype=dtype),repeat)
+                        records.append(dict(param,call='euler_deconv_multi',
+                                            time=t,peak_memory=m))
+                        _,t,m=measure(lambda: est_stats.classic(
+                            est_classic,area,SI_vet,'benchmark'),repeat)
+                        records.append(dict(param,call='classic',time=t,
+                                            peak_memory=m))
+                        print('size %d winsize %d SIs %d filt %.2f' %
+                              (n,winsize,nsi,filt))
+            if stages:
+                records+=_run_stages(data,xi,yi,zi,shape,area,winsizes,filts,
+                                     [SI_all[:nsi] for nsi in nsis],repeat,
+                                     dtype)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return records
+
+def _run_stages(data,xi,yi,zi,shape,area,winsizes,filts,SI_vets,repeat,
+                dtype):
+    """
+    Time and peak memory of the stages of Euler deconvolution of one grid
+    - derivatives, window sums, solution of the systems, selection of the
+    reliable estimates and statistics - measured one by one.
+
+    Returns:
+
+    * records : list of dict
+        time and peak memory of each stage
+    """
+    records=[]
+    n=shape[0]
+    grid=data.reshape(shape).astype(dtype)
+    xi,yi,zi,origin=euler.reference_coordinates(
+        xi.reshape(shape),yi.reshape(shape),zi.reshape(shape),area,dtype)
+    derivs,t,m=measure(lambda: euler.deriv(grid,shape,area,dtype=dtype),
+                       repeat)
+    records.append({'size':n, 'dtype':np.dtype(dtype).name,
+                    'stage':'deriv', 'time':t, 'peak_memory':m})
+    dx,dy,dz=derivs
+    for winsize in winsizes:
+        sums,t,m=measure(lambda: euler.window_sums(
+            grid,dx,dy,dz,xi,yi,zi,winsize),repeat)
+        stdz=euler.window_stdz(sums)
+        param={'size':n, 'dtype':np.dtype(dtype).name, 'winsize':winsize}
+        records.append(dict(param,stage='window_sums',time=t,peak_memory=m))
+        for SI_vet in SI_vets:
+            nsi=len(SI_vet)
+            est_vet,t,m=measure(lambda: [
+                euler.solve_windows(sums,SI,origin=origin)
+                for SI in SI_vet],repeat)
+            records.append(dict(param,nsi=nsi,stage='solve',time=t,
+                                peak_memory=m))
+            for filt in filts:
+                est_classic,t,m=measure(lambda: [
+                    euler.select_estimates(est,stdz,shape,winsize,filt)
+                    for est in est_vet],repeat)
+                records.append(dict(param,nsi=nsi,filt=filt,stage='select',
+                                    time=t,peak_memory=m))
+                _,t,m=measure(lambda: est_stats.classic(
+                    est_classic,area,SI_vet,'benchmark'),repeat)
+                records.append(dict(param,nsi=nsi,filt=filt,
+                                    stage='statistics',time=t,
+                                    peak_memory=m))
+    return records
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Benchmark of Euler '
+                                   'deconvolution')
+    parser.add_argument('--sizes',type=int,nargs='+',
+                        default=[100,250,500,1000,2000],
+                        help='number of grid nodes in each direction')
+    parser.add_argument('--winsizes',type=int,nargs='+',default=[5,7,9,11],
+                        help='sizes of the moving data window')
+    parser.add_argument('--filts',type=float,nargs='+',default=[0.1],
+                        help='percentages of the solutions kept')
+    parser.add_argument('--nsis',type=int,nargs='+',default=[1,4,8],
+                        help='numbers of structural indices')
+    parser.add_argument('--dtype',default='float64',
+                        choices=['float64','float32'],
+                        help='precision of the computation')
+    parser.add_argument('--repeat',type=int,default=3,
+                        help='number of timed runs of each stage')
+    parser.add_argument('--stages',action='store_true',
+                        help='also measure the stages inside '
+                        'euler_deconv_multi one by one')
+    parser.add_argument('--label',default='',
+                        help='name of the version of the code')
+    parser.add_argument('--output',default='results/benchmark.json',
+                        help='JSON file that receives the results')
+    args=parser.parse_args()
+
+    records=run(args.sizes,args.winsizes,args.filts,args.nsis,args.repeat,
+                np.dtype(args.dtype),args.stages)
+    output={'label':args.label, 'python':platform.python_version(),
+            'numpy':np.__version__, 'machine':platform.machine(),
+            'records':records}
+    with open(args.output,'w') as fid:
+        json.dump(output,fid,indent=1)
@@ -0,0 +1,278 @@
+"""
+Estimates clustering
+
+A Python program to group the reliable Euler deconvolution estimates in
+clusters and to rank the structural indices by the tightness of the
+clusters - the correct SI gives the most tightly clustered estimates,
+globally or for each source.
+
+The estimates are hashed to the cells of a horizontal grid. The cells
+with a minimum number of estimates are dense, and neighbouring dense cells
+(including the diagonals) form a cluster. The estimates of the other cells
+are not assigned to any cluster. The cost grows almost linearly with the
+number of estimates.
+
+The outputs are placed at the folder 'results'.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import numpy as np
+
+def cluster_estimates(est,cell,min_points=5):
+    """
+    Group the estimates of one SI in clusters.
+
+    Parameters:
+
+    * est : 2d-array
+        x, y, z and base-level estimates
+    * cell : float
+        size of the cells of the horizontal grid, in the units of the
+        coordinates
+    * min_points : int
+        minimum number of estimates of a dense cell
+
+    Returns:
+
+    * labels : 1d-array
+        the cluster of each estimate, -1 for the estimates not assigned
+    * clusters : 2d-array
+        one row for each cluster: number of estimates, mean x, mean y,
+        mean z, horizontal dispersion (root mean square distance to the
+        mean position), dispersion in z (standard deviation) and 3D
+        dispersion (root mean square distance to the mean position)
+    """
+    xyz=np.asarray(est,dtype=np.float64)[:,:3]
+    labels=np.full(len(xyz),-1,dtype=int)
+    if len(xyz) == 0:
+        return labels,np.zeros((0,7))
+    ij=np.floor((xyz[:,:2] - xyz[:,:2].min(axis=0))/cell).astype(np.int64)
+    width=ij[:,1].max() + 3
+    keys,point_cell,counts=np.unique(_cell_keys(ij,width),
+                                     return_inverse=True,return_counts=True)
+    point_cell=point_cell.ravel()
+    dense=np.flatnonzero(counts >= min_points)
+    if len(dense) == 0:
+        return labels,np.zeros((0,7))
+    cell_label=np.full(len(keys),-1,dtype=int)
+    cell_label[dense]=_grid_components(keys[dense],width)
+    labels=cell_label[point_cell]
+
+    inside=labels >= 0
+    lab=labels[inside]
+    pts=xyz[inside]
+    ncl=lab.max() + 1
+    count=np.bincount(lab,minlength=ncl).astype(np.float64)
+    mean=np.column_stack([np.bincount(lab,pts[:,k],ncl) for k in range(3)])
+    mean/=count[:,np.newaxis]
+    sq=(pts - mean[lab])**2
+    var=np.column_stack([np.bincount(lab,sq[:,k],ncl) for k in range(3)])
+    var/=count[:,np.newaxis]
+    clusters=np.column_stack((count,mean,np.sqrt(var[:,0] + var[:,1]),
+                              np.sqrt(var[:,2]),np.sqrt(var.sum(axis=1))))
+    return labels,clusters
+
+def _cell_keys(ij,width):
+    """
+    One integer key for each cell (i, j) of the grid. The border of width
+    one around the cells keeps the keys of the neighbours unique.
+    """
+    return (ij[:,0] + 1)*width + ij[:,1] + 1
+
+def _grid_components(keys,width):
+    """
+    Connected components of the cells with sorted keys, including the
+    diagonal neighbours. The labels are propagated to the smallest index
+    of each component.
+    """
+    index=np.arange(len(keys))
+    labels=index.copy()
+    neighbours=[]
+    for di in (-1,0,1):
+        for dj in (-1,0,1):
+            if di == 0 and dj == 0:
+                continue
+            nkey=keys + di*width + dj
+            pos=np.minimum(np.searchsorted(keys,nkey),len(keys) - 1)
+            found=keys[pos] == nkey
+            neighbours.append((index[found],pos[found]))
+    while True:
+        new=labels.copy()
+        for cells,nbs in neighbours:
+            np.minimum.at(new,cells,labels[nbs])
+        # pointer jumping, to follow the labels of the labels
+        new=new[new]
+        if np.array_equal(new,labels):
+            break
+        labels=new
+    return np.unique(labels,return_inverse=True)[1].ravel()
+
+def si_ranking(est_classic,SI_vet,cell,min_points=5):
+    """
+    Rank the structural indices by the tightness of the clusters of their
+    estimates. The score of a SI is the relative dispersion in z of its
+    clusters (the dispersion in z over the mean depth, without units),
+    averaged with the weights of their number of estimates: the smaller,
+    the tighter. The depths grow with the SI, and so does their absolute
+    dispersion, so only the relative one compares the SIs. The horizontal
+    dispersion is not used because it follows the extent of elongated
+    sources for any SI.
+    This ranking suits surveys where all the sources have the same SI -
+    see source_si for sources with distinct SIs.
+
+    Parameters:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level estimates, one array for each SI
+    * SI_vet : list
+        structural indices of the estimates
+    * cell : float
+        size of the cells of the horizontal grid
+    * min_points : int
+        minimum number of estimates of a dense cell
+
+    Returns:
+
+    * ranking : 2d-array
+        one row for each SI, from the tightest to the loosest: SI, score,
+        number of clusters and fraction of the estimates in clusters
+    * clusters : list of 2d-array
+        the clusters of each SI, in the order of SI_vet - see
+        cluster_estimates
+    """
+    rows=[]
+    clusters=[]
+    for SI,est in zip(SI_vet,est_classic):
+        labels,cl=cluster_estimates(est,cell,min_points)
+        clusters.append(cl)
+        if len(cl) > 0:
+            score=np.sum(cl[:,0]*_relative(cl[:,5],cl[:,3]))/np.sum(cl[:,0])
+            fraction=np.count_nonzero(labels >= 0)/float(len(labels))
+        else:
+            score,fraction=np.inf,0.
+        rows.append([SI,score,len(cl),fraction])
+    ranking=np.array(rows,dtype=np.float64).reshape(-1,4)
+    ranking=ranking[np.argsort(ranking[:,1],kind='stable')]
+    return ranking,clusters
+
+def _relative(dispersion,meanz):
+    """
+    Dispersion in z over the mean depth, infinite at a null mean depth.
+    """
+    with np.errstate(invalid='ignore',divide='ignore'):
+        relative=dispersion/np.abs(meanz)
+    return np.where(np.isfinite(relative),relative,np.inf)
+
+def source_si(est_classic,SI_vet,cell,min_points=5):
+    """
+    The SI of each source. The horizontal positions of the estimates of
+    all the SIs are clustered together, so each cluster gathers the
+    estimates of one source for every SI, and the SI whose estimates have
+    the smallest relative dispersion in z (over their mean depth) inside
+    the cluster is chosen - see si_ranking.
+
+    Parameters:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level estimates, one array for each SI
+    * SI_vet : list
+        structural indices of the estimates
+    * cell : float
+        size of the cells of the horizontal grid
+    * min_points : int
+        minimum number of estimates of each SI of a dense cell
+
+    Returns:
+
+    * sources : 2d-array
+        one row for each cluster: number of estimates, mean x, mean y,
+        the chosen SI, followed by the mean z and the dispersion in z of
+        the estimates of each SI in SI_vet
+    """
+    nsi=len(SI_vet)
+    est_all=np.concatenate([np.asarray(est)[:,:3] for est in est_classic])
+    which=np.repeat(np.arange(nsi),[len(est) for est in est_classic])
+    labels,clusters=cluster_estimates(est_all,cell,min_points*nsi)
+    sources=np.full((len(clusters),4 + 2*nsi),np.nan)
+    sources[:,:3]=clusters[:,:3]
+    inside=labels >= 0
+    ncl=len(clusters)
+    for k in range(nsi):
+        sel=inside & (which == k)
+        lab=labels[sel]
+        z=est_all[sel,2]
+        count=np.bincount(lab,minlength=ncl).astype(np.float64)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            meanz=np.bincount(lab,z,ncl)/count
+            varz=np.bincount(lab,(z - meanz[lab])**2,ncl)/count
+        sources[:,4 + 2*k]=meanz
+        sources[:,5 + 2*k]=np.sqrt(varz)
+    disp=_relative(sources[:,5::2],sources[:,4::2])
+    if ncl > 0:
+        sources[:,3]=np.asarray(SI_vet,dtype=np.float64)[np.argmin(disp,
+                                                                   axis=1)]
+    return sources
+
+def classic_clusters(est_classic,SI_vet,cell,min_points,name,
+                     folder='results'):
+    """
+    Cluster the estimates of all the SIs and save, with the coordinates in
+    km, the clusters in 'folder/name.txt', the ranking of the SIs in
+    'folder/name_ranking.txt' and the SI of each source in
+    'folder/name_sources.txt'.
+
+    Parameters:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level estimates, one array for each SI
+    * SI_vet : list
+        structural indices of the estimates
+    * cell : float
+        size of the cells of the horizontal grid
+    * min_points : int
+        minimum number of estimates of a dense cell
+    * name : str
+        name of the output files
+    * folder : str
+        folder of the output files
+
+    Returns:
+
+    * ranking : 2d-array
+        the ranking of the SIs - see si_ranking
+    * sources : 2d-array
+        the SI of each source - see source_si
+    """
+    ranking,clusters=si_ranking(est_classic,SI_vet,cell,min_points)
+    output=[]
+    for SI,cl in zip(SI_vet,clusters):
+        for k,row in enumerate(cl):
+            output.append([SI,k,row[0]] + list(row[1:]/1000.))
+    np.savetxt(str(folder)+'/'+str(name)+'.txt',np.reshape(output,(-1,9)),
+               fmt=['%.3f','%d','%d'] + ['%.3f']*6,
+               header="SI, cluster, count, mean x, mean y, mean z, "
+                      "horizontal dispersion, z dispersion, 3D dispersion",
+               comments='')
+    np.savetxt(str(folder)+'/'+str(name)+'_ranking.txt',ranking,
+               fmt=['%.3f','%.4f','%d','%.3f'],
+               header="SI, relative z dispersion, clusters, "
+                      "fraction clustered",
+               comments='')
+
+    sources=source_si(est_classic,SI_vet,cell,min_points)
+    output=np.column_stack((sources[:,0],sources[:,1:3]/1000.,sources[:,3],
+                            sources[:,4:]/1000.))
+    header="count, mean x, mean y, SI" + "".join(
+        [", mean z SI=%g, z dispersion SI=%g" % (SI,SI) for SI in SI_vet])
+    np.savetxt(str(folder)+'/'+str(name)+'_sources.txt',output,
+               fmt=['%d'] + ['%.3f']*(output.shape[1] - 1),
+               header=header,comments='')
+    return ranking,sources
@@ -7,6 +7,8 @@ depth estimates.
 The outputs are placed at the folder 'results'.
 The nomenclature is 'classic_pltX.txt', where
 X stands for the area corresponding to the SI plotted.
+The function classic_areas computes the statistics of many areas
+(rectangles or polygons) at once and saves them in one file.
 
 This code is released from the paper: 
 Reliable Euler deconvolution estimates throughout the
@@ -20,30 +22,192 @@ email: felipe146@hotmail.com, valcris@on.br
 
 import numpy as np
 
+#number of estimates assigned to the areas at a time
+CHUNK=1000000
+
 def classic(est_classic,area_plt,SI_vet,name):
     
-    results = []
-    
-    for i in range(len(est_classic)):
-        
-        estimates=np.stack((est_classic[i][:,0],est_classic[i][:,1],
-                            est_classic[i][:,2],est_classic[i][:,3]),axis=-1)
-        
-        masked =np.ma.array(estimates,mask=np.repeat(estimates[:,0]<=
-                                            area_plt[0],estimates.shape[1]))
-        masked = np.ma.array(masked, mask=np.repeat(masked[:,0]>=area_plt[1],
-                                                        estimates.shape[1]))
-        masked = np.ma.array(masked, mask=np.repeat(masked[:,1]<=area_plt[2],
-                                                        estimates.shape[1]))
-        masked = np.ma.array(masked, mask=np.repeat(masked[:,1]>=area_plt[3],
-                                                        estimates.shape[1]))
-        
-        meanx=(np.mean(masked[:, 0]/1000.))
-        meany=(np.mean(masked[:, 1]/1000.))
-        meanz=(np.mean(masked[:, 2]/1000.))        
-        results.append([SI_vet[i],meanx,meany,meanz])
-        
-    output=np.array([(results[i]) for i in range (0,len(SI_vet))])             
+    stats=area_statistics(est_classic,[area_plt])[0]
+    output=np.column_stack((SI_vet,stats[:,1:4]))
     np.savetxt('results/'+str(name)+'.txt',output,fmt='%.3f',\
                header="SI, mean x, mean y, mean z",comments='')              
-    return
\ No newline at end of file
+    return
+
+def classic_areas(est_classic,areas,SI_vet,name,folder='results'):
+    """
+    Statistics of the estimates of all the SIs inside many areas, saved in
+    one file 'folder/name.txt' with one line for each area and SI:
+    area, SI, count, mean x, mean y, mean z, std x, std y, std z.
+
+    Parameters:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level estimates, one array for each SI
+    * areas : list
+        the areas - see area_statistics
+    * SI_vet : list
+        structural indices of the estimates
+    * name : str
+        name of the output file
+    * folder : str
+        folder of the output file
+
+    Returns:
+
+    * stats : 3d-array
+        statistics of each area and SI - see area_statistics
+    """
+    stats=area_statistics(est_classic,areas)
+    narea,nsi=stats.shape[:2]
+    output=np.column_stack((np.repeat(np.arange(narea),nsi),
+                            np.tile(SI_vet,narea),stats.reshape(-1,7)))
+    np.savetxt(str(folder)+'/'+str(name)+'.txt',output,
+               fmt=['%d','%.3f','%d'] + ['%.3f']*6,
+               header="area, SI, count, mean x, mean y, mean z, "
+                      "std x, std y, std z",comments='')
+    return stats
+
+def area_statistics(est_classic,areas):
+    """
+    Count, mean and standard deviation of the x, y and z estimates inside
+    each area, for all the areas in one pass over the estimates.
+    The estimates are assigned to the areas through a grid of bins over
+    the areas, so each estimate is tested only against the areas that
+    overlap its bin.
+
+    Parameters:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level estimates, one array for each SI
+    * areas : list
+        each area is a rectangle [south, north, west, east] or a polygon,
+        an array with the (x, y) coordinates of its vertices in the rows.
+        Estimates on the edges of the rectangles are outside of them
+
+    Returns:
+
+    * stats : 3d-array
+        count, mean x, mean y, mean z, std x, std y and std z (in km) of
+        the estimates of each area (first index) and SI (second index).
+        The means and std of areas without estimates are nan
+    """
+    bounds,polygons=_area_bounds(areas)
+    index=_AreaIndex(bounds)
+    center=np.column_stack(((bounds[:,0] + bounds[:,1])/2.,
+                            (bounds[:,2] + bounds[:,3])/2.,
+                            np.zeros(len(bounds))))
+    stats=np.full((len(bounds),len(est_classic),7),np.nan)
+    for i,est in enumerate(est_classic):
+        count=np.zeros(len(bounds))
+        total=np.zeros((len(bounds),3))
+        squares=np.zeros((len(bounds),3))
+        for start in range(0,len(est),CHUNK):
+            xyz=np.asarray(est[start:start + CHUNK,:3],dtype=np.float64)
+            point,area=index.query(xyz[:,0],xyz[:,1],bounds,polygons)
+            # shift to the center of the areas to avoid cancellation
+            values=xyz[point] - center[area]
+            count+=np.bincount(area,minlength=len(bounds))
+            for k in range(3):
+                total[:,k]+=np.bincount(area,values[:,k],len(bounds))
+                squares[:,k]+=np.bincount(area,values[:,k]**2,len(bounds))
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean=total/count[:,np.newaxis]
+            var=squares/count[:,np.newaxis] - mean**2
+        stats[:,i,0]=count
+        stats[:,i,1:4]=(mean + center)/1000.
+        stats[:,i,4:7]=np.sqrt(np.maximum(var,0.))/1000.
+    return stats
+
+def _area_bounds(areas):
+    """
+    Bounding boxes [south, north, west, east] of the areas, and their
+    vertices (None for the rectangles).
+    """
+    bounds=[]
+    polygons=[]
+    for area in areas:
+        area=np.asarray(area,dtype=np.float64)
+        if area.ndim == 1:
+            bounds.append(area)
+            polygons.append(None)
+        else:
+            bounds.append([area[:,0].min(),area[:,0].max(),
+                           area[:,1].min(),area[:,1].max()])
+            polygons.append(area)
+    return np.array(bounds,dtype=np.float64).reshape(-1,4),polygons
+
+def _in_polygon(x,y,polygon):
+    """
+    Points inside a polygon, by the even-odd rule.
+    """
+    inside=np.zeros(len(x),dtype=bool)
+    x0,y0=polygon[-1]
+    for x1,y1 in polygon:
+        cross=(y1 > y) != (y0 > y)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            xcross=x1 + (y - y1)*(x0 - x1)/(y0 - y1)
+        inside^=cross & (x < xcross)
+        x0,y0=x1,y1
+    return inside
+
+class _AreaIndex(object):
+    """
+    Grid of bins over the bounding boxes of the areas, with the areas that
+    overlap each bin.
+    """
+    def __init__(self,bounds):
+        nbins=int(np.ceil(np.sqrt(len(bounds)))) + 1
+        self.x0=bounds[:,0].min()
+        self.y0=bounds[:,2].min()
+        self.nbins=nbins
+        self.sizex=max(bounds[:,1].max() - self.x0,1e-9)/nbins
+        self.sizey=max(bounds[:,3].max() - self.y0,1e-9)/nbins
+        bins=[]
+        owner=[]
+        for k,(south,north,west,east) in enumerate(bounds):
+            i0,i1=self._bin(np.array([south,north]),self.x0,self.sizex)
+            j0,j1=self._bin(np.array([west,east]),self.y0,self.sizey)
+            cells=np.add.outer(np.arange(i0,i1 + 1)*nbins,
+                               np.arange(j0,j1 + 1)).ravel()
+            bins.append(cells)
+            owner.append(np.full(len(cells),k))
+        bins=np.concatenate(bins)
+        owner=np.concatenate(owner)
+        order=np.argsort(bins,kind='stable')
+        self.areas=owner[order]
+        self.count=np.bincount(bins,minlength=nbins*nbins)
+        self.start=np.concatenate(([0],np.cumsum(self.count)[:-1]))
+
+    def _bin(self,x,x0,size):
+        return np.clip(((x - x0)//size).astype(int),0,self.nbins - 1)
+
+    def query(self,x,y,bounds,polygons):
+        """
+        Pairs (estimate, area) of the estimates inside the areas.
+        """
+        binx=self._bin(x,self.x0,self.sizex)
+        biny=self._bin(y,self.y0,self.sizey)
+        cell=binx*self.nbins + biny
+        ncand=self.count[cell]
+        # candidate pairs: each estimate with every area of its bin
+        point=np.repeat(np.arange(len(x)),ncand)
+        first=np.repeat(np.cumsum(ncand) - ncand,ncand)
+        area=self.areas[np.repeat(self.start[cell],ncand) +
+                        np.arange(len(point)) - first]
+        south,north,west,east=bounds[area].T
+        px,py=x[point],y[point]
+        inside=(px > south) & (px < north) & (py > west) & (py < east)
+        polygon=np.array([p is not None for p in polygons])
+        if polygon.any():
+            # the pairs of the polygons sorted by area, tested one slice of
+            # pairs for each polygon
+            pairs=np.flatnonzero(polygon[area])
+            pairs=pairs[np.argsort(area[pairs],kind='stable')]
+            sorted_area=area[pairs]
+            keys=np.unique(sorted_area)
+            starts=np.searchsorted(sorted_area,keys)
+            ends=np.searchsorted(sorted_area,keys,side='right')
+            for k,i0,i1 in zip(keys,starts,ends):
+                sel=pairs[i0:i1]
+                inside[sel]=_in_polygon(px[sel],py[sel],polygons[k])
+        return point[inside],area[inside]
@@ -0,0 +1,252 @@
+"""
+Grid input and output
+
+A Python program to store gridded data in a binary file that can be
+memory-mapped, and to convert the 4-column text files (x-coordinate,
+y-coordinate, z-coordinate, anomaly) to this format.
+
+The binary grid file has a header with the shape and the area of the grid
+followed by the grids of the fields, stored as 64-bit floats:
+    - 8 bytes: the identifier b'EULERGRD'
+    - 8 bytes: the length of the header (little-endian unsigned integer)
+    - the header: a JSON text with the version, shape, area and fields
+    - the grids of the fields, one after the other, in the order of the
+      header, each with the shape of the grid
+For regular grids only the z-coordinate and the anomaly are stored and the
+x- and y-coordinates are computed from the shape and the area. The grids
+interpolated from scattered samples (see gridding.py) also store the mask
+of the grid nodes covered by the samples, as 1 and 0.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import json
+import sys
+import numpy as np
+
+MAGIC=b'EULERGRD'
+#the grids start at a multiple of this number of bytes
+ALIGN=64
+
+def grid_coordinates(shape,area):
+    """
+    Coordinates of the nodes of a regular grid. The grids are read-only
+    views of the coordinate vectors, they do not use memory for each node.
+
+    Parameters:
+
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+
+    Returns:
+
+    * xi, yi : 2d-array
+        grid of coordinates in x- and y-directions
+    """
+    xs=np.linspace(area[0],area[1],shape[0])
+    ys=np.linspace(area[2],area[3],shape[1])
+    xi=np.broadcast_to(xs[:,np.newaxis],tuple(shape))
+    yi=np.broadcast_to(ys[np.newaxis,:],tuple(shape))
+    return xi,yi
+
+def grid_geometry(xi,yi):
+    """
+    Infer the shape and the area of a grid from the coordinates of the
+    4-column layout, in which the y-coordinate varies first. The
+    coordinates must form a regular lattice in this order: the
+    x-coordinate constant in each block of ny rows and the same
+    y-coordinates in every block.
+
+    Parameters:
+
+    * xi, yi : 1d-array
+        coordinates in x- and y-directions
+
+    Returns:
+
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    """
+    xi=np.asarray(xi,dtype=np.float64).ravel()
+    yi=np.asarray(yi,dtype=np.float64).ravel()
+    changes=np.flatnonzero(xi != xi[0])
+    ny=int(changes[0]) if len(changes) > 0 else len(xi)
+    nx=len(xi)//ny
+    if nx*ny != len(xi):
+        raise ValueError("the coordinates do not define a regular grid")
+    # tolerance for the coordinates written with few digits
+    tol=1e-6*max(np.ptp(xi),np.ptp(yi),1.)
+    blockx=xi.reshape(nx,ny)
+    blocky=yi.reshape(nx,ny)
+    if (np.abs(blockx - blockx[:,:1]).max() > tol or
+        np.abs(blocky - blocky[:1]).max() > tol):
+        raise ValueError("the coordinates do not define a regular grid "
+                         "with the y-coordinate varying first")
+    if ny == 1 and nx > 1:
+        raise ValueError("the grid has a single node in the y-direction")
+    shape=(nx,ny)
+    area=[float(xi.min()),float(xi.max()),float(yi.min()),float(yi.max())]
+    return shape,area
+
+def write_grid(fname,data,xi,yi,zi,shape,area,regular=None,mask=None):
+    """
+    Write a grid to a binary grid file.
+
+    Parameters:
+
+    * fname : str
+        name of the binary grid file
+    * data : 1d-array
+        the input data set
+    * xi, yi, zi : 1d-array
+        grid of coordinates in x-, y- and z-directions
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    * regular : bool
+        if True, the x- and y-coordinates are not stored and are computed
+        from the shape and the area when the file is loaded. Default: True
+        only if the coordinates are exactly the ones of the regular grid
+    * mask : 2d-array
+        True at the grid nodes covered by samples - see load_mask
+    """
+    if regular is None:
+        xs,ys=grid_coordinates(shape,area)
+        regular=(np.array_equal(np.reshape(xi,shape),xs) and
+                 np.array_equal(np.reshape(yi,shape),ys))
+    if regular:
+        fields=[('zi',zi),('data',data)]
+    else:
+        fields=[('xi',xi),('yi',yi),('zi',zi),('data',data)]
+    if mask is not None:
+        fields.append(('mask',mask))
+    header=json.dumps({'version':1, 'shape':[int(n) for n in shape],
+                       'area':[float(a) for a in area],
+                       'fields':[name for name,_ in fields]}).encode('ascii')
+    offset=len(MAGIC) + 8 + len(header)
+    header+=b' '*(-offset % ALIGN)
+    with open(fname,'wb') as fid:
+        fid.write(MAGIC)
+        fid.write(np.array(len(header),dtype='<u8').tobytes())
+        fid.write(header)
+        for _,field in fields:
+            fid.write(np.ascontiguousarray(np.reshape(field,shape),
+                                           dtype='<f8').tobytes())
+
+def _read_header(fname):
+    """
+    The header of a binary grid file and the offset of its grids.
+    """
+    with open(fname,'rb') as fid:
+        if fid.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not a binary grid file" % fname)
+        length=int(np.frombuffer(fid.read(8),dtype='<u8')[0])
+        header=json.loads(fid.read(length).decode('ascii'))
+    return header,len(MAGIC) + 8 + length
+
+def load_grid(fname,mode='r'):
+    """
+    Load a binary grid file. The grids are memory-mapped, so they are read
+    from the disk only when they are used and can be passed directly to
+    the functions of euler_python.
+
+    Parameters:
+
+    * fname : str
+        name of the binary grid file
+    * mode : str
+        mode of the memory map - 'r' read-only, 'r+' read and write or
+        'c' copy-on-write
+
+    Returns:
+
+    * data : 2d-array
+        the input data set - gridded
+    * xi, yi, zi : 2d-array
+        grid of coordinates in x-, y- and z-directions
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    """
+    header,offset=_read_header(fname)
+    shape=tuple(header['shape'])
+    area=header['area']
+    fields=header['fields']
+    grids=np.memmap(fname,dtype='<f8',mode=mode,offset=offset,
+                    shape=(len(fields),) + shape)
+    grids=dict(zip(fields,grids))
+    if 'xi' not in grids:
+        grids['xi'],grids['yi']=grid_coordinates(shape,area)
+    return grids['data'],grids['xi'],grids['yi'],grids['zi'],shape,area
+
+def load_mask(fname):
+    """
+    Load the mask of the grid nodes covered by samples of a binary grid
+    file.
+
+    Parameters:
+
+    * fname : str
+        name of the binary grid file
+
+    Returns:
+
+    * mask : 2d-array
+        True at the grid nodes covered by samples. None if the file has
+        no mask
+    """
+    header,offset=_read_header(fname)
+    fields=header['fields']
+    if 'mask' not in fields:
+        return None
+    shape=tuple(header['shape'])
+    grids=np.memmap(fname,dtype='<f8',mode='r',offset=offset,
+                    shape=(len(fields),) + shape)
+    return grids[fields.index('mask')] != 0
+
+def dat_to_grid(datname,fname,regular=None):
+    """
+    Convert a 4-column text file (x-coordinate, y-coordinate,
+    z-coordinate, anomaly) to a binary grid file. The shape and the area
+    of the grid are inferred from the coordinates.
+
+    Parameters:
+
+    * datname : str
+        name of the text file
+    * fname : str
+        name of the binary grid file
+    * regular : bool
+        store only the z-coordinate and the anomaly - see write_grid
+
+    Returns:
+
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    """
+    data_input=np.loadtxt(datname)
+    xi,yi,zi,data=data_input.T
+    shape,area=grid_geometry(xi,yi)
+    write_grid(fname,data,xi,yi,zi,shape,area,regular)
+    return shape,area
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python grid_io.py input.dat output.grd')
+    shape,area=dat_to_grid(sys.argv[1],sys.argv[2])
+    print('shape: %s, area: %s' % (shape,area))
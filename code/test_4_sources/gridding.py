@@ -0,0 +1,229 @@
+"""
+Gridding
+
+A Python program to interpolate scattered data (e.g. the samples of the
+flight lines of a survey) on the regular grid used by Euler deconvolution,
+by nearest neighbour or inverse-distance weighting, with a mask of the
+grid nodes covered by the samples.
+
+The grid itself is the spatial index: each sample is assigned to its
+closest grid node and visits only the nodes within the search radius,
+so no tree is built and the cost grows linearly with the number of
+samples. The samples are processed in chunks, so the memory used does not
+depend on their number. The nodes without samples within the radius are
+filled from their neighbours, so the grid can be transformed to the
+Fourier domain, and are marked in the mask, so the windows that contain
+them are not solved (see the argument mask of euler_python.euler_deconv).
+
+To grid a 4-column text file (x-coordinate, y-coordinate, z-coordinate,
+anomaly) to a binary grid file run 'python gridding.py -h' for the
+options.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import argparse
+import numpy as np
+import grid_io
+
+#number of pairs of samples and grid nodes processed at a time
+CHUNK=1000000
+
+def grid_points(x,y,values,shape,area,method='nearest',radius=None,
+                power=2.):
+    """
+    Interpolate scattered values on a regular grid.
+
+    Parameters:
+
+    * x, y : 1d-array
+        coordinates of the samples in x- and y-directions
+    * values : 1d- or 2d-array
+        the values of the samples, one column for each field
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the grid - [south, north, west, east]
+    * method : str
+        'nearest' - the value of the closest sample
+        'idw' - the mean of the samples within the radius weighted by
+                the inverse of the distance to the power 'power'
+    * radius : float
+        the maximum distance between a grid node and the samples used.
+        Default: 1.5 times the largest spacing of the grid
+    * power : float
+        the power of the distance of the inverse-distance weights
+
+    Returns:
+
+    * grids : 2d- or 3d-array
+        the grid of each field, with the shape of the grid (in the first
+        axis if values has more than one column)
+    * mask : 2d-array
+        True at the grid nodes with samples within the radius
+    """
+    if method not in ('nearest','idw'):
+        raise ValueError("method must be 'nearest' or 'idw'")
+    x=np.asarray(x,dtype=np.float64).ravel()
+    y=np.asarray(y,dtype=np.float64).ravel()
+    values=np.asarray(values,dtype=np.float64)
+    single=values.ndim == 1
+    values=values.reshape(len(x),-1)
+    nx,ny=shape
+    spacex=(area[1] - area[0])/(nx - 1.)
+    spacey=(area[3] - area[2])/(ny - 1.)
+    if radius is None:
+        radius=1.5*max(spacex,spacey)
+    ri=int(np.ceil(radius/spacex))
+    rj=int(np.ceil(radius/spacey))
+    # nodes around the closest node of a sample that can be within radius
+    offsets=[(di,dj) for di in range(-ri,ri + 1) for dj in range(-rj,rj + 1)
+             if np.hypot(max(abs(di) - 0.5,0)*spacex,
+                         max(abs(dj) - 0.5,0)*spacey) <= radius]
+    nnode=nx*ny
+    grids=np.zeros((values.shape[1],nnode))
+    if method == 'nearest':
+        best=np.full(nnode,np.inf)
+    else:
+        weights=np.zeros(nnode)
+        #distance of a sample on a grid node, to avoid an infinite weight
+        tiny=1e-6*min(spacex,spacey)
+    step=max(CHUNK//len(offsets),1)
+    for start in range(0,len(x),step):
+        fi=(x[start:start + step] - area[0])/spacex
+        fj=(y[start:start + step] - area[2])/spacey
+        value=values[start:start + step]
+        i0=np.rint(fi).astype(np.int64)
+        j0=np.rint(fj).astype(np.int64)
+        nodes,dists,samples=[],[],[]
+        for di,dj in offsets:
+            i=i0 + di
+            j=j0 + dj
+            dist=np.hypot((i - fi)*spacex,(j - fj)*spacey)
+            ok=np.flatnonzero((i >= 0) & (i < nx) & (j >= 0) & (j < ny) &
+                              (dist <= radius))
+            nodes.append(i[ok]*ny + j[ok])
+            dists.append(dist[ok])
+            samples.append(ok)
+        node=np.concatenate(nodes)
+        dist=np.concatenate(dists)
+        sample=np.concatenate(samples)
+        if method == 'nearest':
+            # the closest sample of each node in the chunk
+            order=np.lexsort((dist,node))
+            first=np.ones(len(order),dtype=bool)
+            first[1:]=node[order[1:]] != node[order[:-1]]
+            order=order[first]
+            closer=dist[order] < best[node[order]]
+            order=order[closer]
+            best[node[order]]=dist[order]
+            grids[:,node[order]]=value[sample[order]].T
+        else:
+            weight=1./np.maximum(dist,tiny)**power
+            unique,inverse=np.unique(node,return_inverse=True)
+            inverse=inverse.ravel()
+            weights[unique]+=np.bincount(inverse,weight)
+            for k in range(values.shape[1]):
+                grids[k,unique]+=np.bincount(inverse,
+                                             weight*value[sample,k])
+    if method == 'nearest':
+        mask=np.isfinite(best)
+    else:
+        mask=weights > 0
+        grids[:,mask]/=weights[mask]
+    if not mask.any():
+        raise ValueError("there are no samples inside the area")
+    grids=grids.reshape((-1,) + tuple(shape))
+    mask=mask.reshape(shape)
+    _fill_gaps(grids,mask)
+    return (grids[0] if single else grids),mask
+
+def _fill_gaps(grids,mask):
+    """
+    Fill the grid nodes outside the mask, in place, with the mean of their
+    filled neighbours, from the edges of the gaps inwards.
+    """
+    filled=mask.copy()
+    while not filled.all():
+        total=np.zeros_like(grids)
+        count=np.zeros(filled.shape)
+        for axis in (0,1):
+            for shift in (1,-1):
+                neighbour=np.roll(filled,shift,axis)
+                side=np.roll(grids,shift,axis + 1)
+                # np.roll wraps around, the nodes of the opposite edge are
+                # not neighbours
+                edge=[slice(None)]*2
+                edge[axis]=0 if shift == 1 else -1
+                neighbour[tuple(edge)]=False
+                count+=neighbour
+                total+=np.where(neighbour,side,0.)
+        new=~filled & (count > 0)
+        grids[:,new]=total[:,new]/count[new]
+        filled|=new
+
+def grid_survey(x,y,z,anomaly,shape,area,method='nearest',radius=None,
+                power=2.):
+    """
+    Grid the samples of a survey - the anomaly and the height of the
+    samples are interpolated with the same neighbours.
+
+    Parameters:
+
+    * x, y, z : 1d-array
+        coordinates of the samples in x-, y- and z-directions
+    * anomaly : 1d-array
+        the total-field anomaly of the samples
+    * shape, area, method, radius, power :
+        the grid and the interpolation - see grid_points
+
+    Returns:
+
+    * data : 2d-array
+        the input data set - gridded
+    * xi, yi, zi : 2d-array
+        grid of coordinates in x-, y- and z-directions
+    * mask : 2d-array
+        True at the grid nodes with samples within the radius
+    """
+    grids,mask=grid_points(x,y,np.column_stack((anomaly,z)),shape,area,
+                           method,radius,power)
+    xi,yi=grid_io.grid_coordinates(shape,area)
+    return grids[0],xi,yi,grids[1],mask
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Grid the scattered samples '
+                                   'of a 4-column text file (x, y, z, '
+                                   'anomaly) in a binary grid file')
+    parser.add_argument('input',help='text file with the samples')
+    parser.add_argument('output',help='binary grid file')
+    parser.add_argument('--shape',type=int,nargs=2,required=True,
+                        metavar=('NX','NY'),help='shape of the grid')
+    parser.add_argument('--area',type=float,nargs=4,
+                        metavar=('SOUTH','NORTH','WEST','EAST'),
+                        help='area of the grid. Default: the limits of '
+                             'the samples')
+    parser.add_argument('--method',default='nearest',
+                        choices=['nearest','idw'],help='interpolation')
+    parser.add_argument('--radius',type=float,
+                        help='maximum distance of the samples to a node')
+    parser.add_argument('--power',type=float,default=2.,
+                        help='power of the inverse-distance weights')
+    args=parser.parse_args()
+
+    x,y,z,anomaly=np.loadtxt(args.input).T
+    area=args.area
+    if area is None:
+        area=[x.min(),x.max(),y.min(),y.max()]
+    data,xi,yi,zi,mask=grid_survey(x,y,z,anomaly,args.shape,area,
+                                   args.method,args.radius,args.power)
+    grid_io.write_grid(args.output,data,xi,yi,zi,args.shape,area,
+                       regular=True,mask=mask)
+    print('%d of %d grid nodes covered' % (mask.sum(),mask.size))
@@ -5,6 +5,10 @@ A Python program to plot the total-field anomaly and the estimates
 on classic plot. 
 
 This code plot the figures 2d, 4 and 7 in the folder 'figures'.
+For large sets of estimates, plot_classic_fast draws the same figures from
+a background raster computed once, aggregates the estimates in bins when
+they are too many to be drawn one by one and renders the panels in
+parallel processes.
 
 This code is released from the paper: 
 Reliable Euler deconvolution estimates throughout the
@@ -19,6 +23,12 @@ email: felipe146@hotmail.com, valcris@on.br
 import numpy as np
 import matplotlib.pylab as plt
 import matplotlib.patches as patches
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+#estimates of a panel above which plot_classic_fast draws the mean of the
+#estimates in bins instead of each estimate
+max_points=20000
 
 #######################################################################
 
@@ -194,4 +204,209 @@ def plot_classic(data,est_classic,xi,yi,zi,shape):
     plt.savefig('figures/FIG7.png',bbox_inches='tight', dpi = 600)
     plt.close('all')
     
-    return
\ No newline at end of file
+    return
+
+
+def background_raster(data,xi,yi,shape,cmap='gray',levels=30,pixels=2000):
+    '''
+    Render the filled contours of the data once, as an image that the
+    panels of plot_classic_fast show as background.
+
+    Parameters:
+
+    * data : 1d-array
+        the input data set
+    * xi, yi : 1d-array
+        grid of coordinates in x- and y-directions
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * cmap : str
+        colormap of the contours
+    * levels : int
+        number of levels of the contours
+    * pixels : int
+        number of pixels of the largest side of the image
+
+    Returns:
+
+    * background : 3d-array
+        the RGBA image, with the north up
+    * extent : list
+        the limits of the image in km - [west, east, south, north]
+    '''
+    extent=[np.min(yi)/1000.,np.max(yi)/1000.,np.min(xi)/1000.,
+            np.max(xi)/1000.]
+    ratio=(extent[3] - extent[2])/(extent[1] - extent[0])
+    width,height=(pixels,max(int(pixels*ratio),1)) if ratio <= 1 else \
+                 (max(int(pixels/ratio),1),pixels)
+    fig=Figure(figsize=(width/100.,height/100.),dpi=100)
+    canvas=FigureCanvasAgg(fig)
+    ax=fig.add_axes([0,0,1,1])
+    ax.set_axis_off()
+    ax.contourf(np.reshape(yi,shape)/1000.,np.reshape(xi,shape)/1000.,
+                np.reshape(data,shape),levels,cmap=cmap)
+    ax.set_xlim(extent[0],extent[1])
+    ax.set_ylim(extent[2],extent[3])
+    canvas.draw()
+    background=np.asarray(canvas.buffer_rgba()).copy()
+    return background,extent
+
+def _classic_panels(est_classic,annotate=True):
+    '''
+    Parameters of the panels of the Figures 4 and 7 - see plot_classic.
+    Without annotate, the colour scales are the 2 and 98 percentiles of
+    the estimates of each panel.
+    '''
+    panels=[]
+    for i,est in enumerate(est_classic):
+        est=np.asarray(est)
+        if annotate:
+            vmin,vmax,ticks,fmt=0.,2.,np.linspace(0.,2.,11),'%0.1f'
+        else:
+            vmin,vmax=_color_range(est[:,2]/1000.)
+            ticks,fmt=None,None
+        panels.append({'est':est, 'column':2, 'scale':1000.,
+                       'cmap':'terrain_r', 'vmin':vmin, 'vmax':vmax,
+                       'ticks':ticks, 'format':fmt,
+                       'label':'$\\^z_o$ (km)', 'title':'(%s)' % chr(97 + i),
+                       'note':None, 'annotate':annotate})
+    for i,est in enumerate(est_classic):
+        est=np.asarray(est)
+        if annotate:
+            #base level estimates for SI = 0 have higher amplitude
+            vmin,vmax,scale=(-70,20,1000.) if i == 0 else (-30,210,1.)
+            ticks,fmt=np.linspace(vmin,vmax,7),'%d'
+        else:
+            scale=1.
+            vmin,vmax=_color_range(est[:,3])
+            ticks,fmt=None,None
+        panels.append({'est':est, 'column':3, 'scale':scale,
+                       'cmap':'jet', 'vmin':vmin, 'vmax':vmax,
+                       'ticks':ticks, 'format':fmt,
+                       'label':'$\\^b$ (nT)', 'title':'(%s)' % chr(97 + i),
+                       'note':'x10$^{3}$' if annotate and i == 0 else None,
+                       'annotate':annotate})
+    return panels
+
+def _color_range(values):
+    '''
+    The 2 and 98 percentiles of the values, the limits of a colour scale.
+    '''
+    if len(values) == 0:
+        return 0.,1.
+    return tuple(np.percentile(values,[2,98]))
+
+def _render_panel(job):
+    '''
+    Render one panel of plot_classic_fast as an RGBA image. Only the
+    object-oriented interface of matplotlib is used, so the panels can be
+    rendered in worker processes.
+    '''
+    panel,background,extent,dpi,npoints,bins=job
+    fig=Figure(figsize=(6,4.25),dpi=dpi)
+    canvas=FigureCanvasAgg(fig)
+    fig.subplots_adjust(left=0.13,right=0.92,bottom=0.2,top=0.97)
+    ax=fig.add_subplot(1,1,1)
+    ax.set_title(panel['title'],fontsize=14,loc='center',y=-0.27)
+    ax.imshow(background,extent=extent,aspect='auto',interpolation='bilinear')
+    est=np.asarray(panel['est'])
+    east,north=est[:,1]/1000.,est[:,0]/1000.
+    values=est[:,panel['column']]/panel['scale']
+    if len(est) > npoints:
+        #mean of the estimates in each bin
+        hist_range=[[extent[0],extent[1]],[extent[2],extent[3]]]
+        count=np.histogram2d(east,north,bins,hist_range)[0]
+        total=np.histogram2d(east,north,bins,hist_range,weights=values)[0]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean=np.ma.masked_invalid((total/count).T)
+        mappable=ax.imshow(mean,extent=extent,origin='lower',aspect='auto',
+                           interpolation='nearest',cmap=panel['cmap'],
+                           vmin=panel['vmin'],vmax=panel['vmax'])
+    else:
+        mappable=ax.scatter(east,north,s=40,c=values,cmap=panel['cmap'],
+                            vmin=panel['vmin'],vmax=panel['vmax'],
+                            edgecolors='k',rasterized=True)
+    cbar=fig.colorbar(mappable,ax=ax,ticks=panel['ticks'],pad=0.01,shrink=1,
+                      format=panel['format'])
+    cbar.set_label(panel['label'],labelpad=-18,y=-0.03,rotation=0,
+                   fontsize=13)
+    cbar.ax.tick_params(labelsize=13)
+    ax.set_ylabel('Northing (km)',fontsize=14)
+    ax.set_xlabel('Easting (km)',fontsize=14)
+    ax.tick_params(labelsize=13)
+    ax.set_xlim(extent[0],extent[1])
+    ax.set_ylim(extent[2],extent[3])
+    if panel['annotate']:
+        ax.set_xticks([0,5,10,15,20,25])
+        ax.text(22.5,5,'P0',color='w',size='large')
+        ax.text(13.5,14,'P1',color='w',size='large')
+        ax.text(3,16,'P2',color='w',size='large')
+        ax.text(3,5,'P3',color='w',size='large')
+    if panel['note'] is not None:
+        ax.text(25,25,panel['note'],color='k',size='medium')
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+def plot_classic_fast(data,est_classic,xi,yi,zi,shape,workers=None,dpi=300,
+                      npoints=None,bins=200,folder='figures',annotate=True):
+    '''
+    Classic plot of the depth and base level estimates for all SIs - the
+    Figures 4 and 7 of plot_classic, for large sets of estimates. The
+    filled contours of the data are rendered once and reused by all the
+    panels, the panels with more than npoints estimates show the mean
+    of the estimates in bins and the panels are rendered in parallel
+    processes and joined in the figures.
+
+    Parameters:
+
+    * data : 1d-array
+        the input data set
+    * est_classic : list of 2d-array
+        x, y, z and base-level best estimates, one array for each SI
+    * xi, yi, zi : 1d-array
+        grid of coordinates in x-, y- and z-directions
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * workers : int
+        number of processes that render the panels. Default: render in
+        this process
+    * dpi : int
+        resolution of the figures
+    * npoints : int
+        number of estimates of a panel above which the estimates are
+        aggregated in bins. Default: the module variable max_points
+    * bins : int
+        number of bins in each direction
+    * folder : str
+        folder of the figures FIG4.png and FIG7.png
+    * annotate : bool
+        the colour scales, ticks and labels of the sources of the
+        synthetic test. Otherwise the colour scales follow the estimates
+        of each panel
+    '''
+    npoints=max_points if npoints is None else npoints
+    background,extent=background_raster(data,xi,yi,shape,
+                                        pixels=int(6*dpi))
+    jobs=[(panel,background,extent,dpi,npoints,bins)
+          for panel in _classic_panels(est_classic,annotate)]
+    if workers is not None and workers > 1:
+        import multiprocessing
+        pool=multiprocessing.Pool(workers)
+        try:
+            images=pool.map(_render_panel,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        images=[_render_panel(job) for job in jobs]
+    npanel=len(est_classic)
+    for k,name in enumerate(['FIG4','FIG7']):
+        panels=images[npanel*k:npanel*(k + 1)]
+        #two panels in each row, a blank one completes the last row
+        if npanel % 2 == 1:
+            panels.append(np.full_like(panels[0],255))
+        image=np.concatenate([np.concatenate(panels[j:j + 2],axis=1)
+                              for j in range(0,len(panels),2)],axis=0)
+        plt.imsave(str(folder)+'/'+name+'.png',image,dpi=dpi)
+    
+    return
@@ -0,0 +1,232 @@
+"""
+Result cache
+
+A Python program to keep the derivatives and the estimates of Euler
+deconvolution in a folder of the disk, so a workflow run again with the
+same grid and parameters (e.g. changing only the figures or the areas of
+the statistics) reads them instead of computing them again.
+
+Each result is a .npz file named by a hash of everything it depends on:
+the bytes of the grids, the shape, the area, the SI, the window size, the
+percentage kept, the precision, the padding of the Fourier transform and
+the source code of euler_python.py. A changed grid, parameter or
+computation is a new name, so a result is never out of date. When the files of the cache exceed cache_size bytes, the results
+used least recently are removed.
+
+The functions deriv, euler_deconv and euler_deconv_multi are called as the
+ones of euler_python:
+
+    import result_cache
+    est_classic=result_cache.euler_deconv_multi(data,xi,yi,zi,shape,area,
+                                                SI_vet,winsize,filt)
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import euler_python as euler
+
+#folder of the cached results
+cache_folder='cache'
+#maximum size of the cached results, in bytes
+cache_size=2**30
+#changed when the results of the same inputs change, to ignore old files
+VERSION=1
+#hash of the source code of euler_python.py, read once
+_source=None
+
+def _source_digest():
+    """
+    Hash of the bytes of euler_python.py, so the results computed by
+    another version of the code are not read.
+    """
+    global _source
+    if _source is None:
+        with open(euler.__file__,'rb') as fid:
+            _source=hashlib.blake2b(fid.read(),digest_size=20).hexdigest()
+    return _source
+
+def _digest(arrays):
+    """
+    Hash of the bytes, the precision and the shape of the arrays.
+    """
+    digest=hashlib.blake2b(digest_size=20)
+    for array in arrays:
+        if array is None:
+            digest.update(b'none')
+            continue
+        array=np.ascontiguousarray(array)
+        digest.update(('%s%s' % (array.dtype.str,array.shape)).encode('ascii'))
+        digest.update(array.view(np.uint8).ravel())
+    return digest.hexdigest()
+
+def _key(kind,grids,params):
+    """
+    Name of a result - the hash of the grids (computed by _digest), of the
+    parameters and of the source code.
+    """
+    digest=hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([kind,VERSION,_source_digest(),grids,
+                              params]).encode('ascii'))
+    return kind + '_' + digest.hexdigest()
+
+def _params(shape,area,dtype,padding,margin):
+    """
+    The parameters shared by all the results, as JSON values.
+    """
+    padding=euler.fft_padding if padding is None else padding
+    margin=euler.fft_margin if margin is None else margin
+    return {'shape':[int(n) for n in shape], 'area':[float(a) for a in area],
+            'dtype':np.dtype(euler._float_dtype(dtype)).name,
+            'padding':padding, 'margin':float(margin)}
+
+def _read(key,stats=None):
+    """
+    The arrays of a cached result, or None if it is not in the cache.
+    """
+    fname=os.path.join(cache_folder,key + '.npz')
+    try:
+        with np.load(fname) as result:
+            arrays=[result['arr_%d' % k] for k in range(len(result.files))]
+    except (IOError,OSError,ValueError,KeyError):
+        if stats is not None:
+            stats.count('cache_misses')
+        return None
+    # the time of the last use, for the eviction
+    os.utime(fname,None)
+    if stats is not None:
+        stats.count('cache_hits')
+    return arrays
+
+def _write(key,arrays):
+    """
+    Save a result in the cache and remove the results used least recently
+    if the cache is larger than cache_size.
+    """
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    fname=os.path.join(cache_folder,key + '.npz')
+    # written to another name and renamed, so a result is never read
+    # incomplete
+    temp='%s.%d.tmp.npz' % (fname[:-4],os.getpid())
+    np.savez(temp,*arrays)
+    os.replace(temp,fname)
+    evict(keep=fname)
+
+def evict(size=None,keep=None):
+    """
+    Remove the results used least recently until the cache is not larger
+    than size.
+
+    Parameters:
+
+    * size : int
+        maximum size of the cache, in bytes. Default: cache_size
+    * keep : str
+        file that is not removed (the result just written)
+    """
+    size=cache_size if size is None else size
+    if not os.path.isdir(cache_folder):
+        return
+    files=[]
+    for name in os.listdir(cache_folder):
+        if name.endswith('.npz') and '.tmp.' not in name:
+            fname=os.path.join(cache_folder,name)
+            info=os.stat(fname)
+            files.append((info.st_mtime,info.st_size,fname))
+    total=sum(f[1] for f in files)
+    for _,nbytes,fname in sorted(files):
+        if total <= size:
+            break
+        if fname == keep:
+            continue
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+        total-=nbytes
+
+def clear_cache():
+    """
+    Remove all the cached results.
+    """
+    evict(0)
+
+def deriv(data,shape,area,stats=None,padding=None,margin=None,dtype=None):
+    """
+    euler_python.deriv, read from the cache when the same derivatives were
+    computed before.
+
+    Returns:
+
+    * derivx, derivy, derivz : 2D-array
+        derivatives in x-, y- and z-directions
+    """
+    data=np.reshape(data,shape)
+    params=_params(shape,area,dtype,padding,margin)
+    key=_key('deriv',_digest([data]),params)
+    derivs=_read(key,stats)
+    if derivs is None:
+        derivs=euler.deriv(data,shape,area,stats,padding,margin,dtype)
+        _write(key,derivs)
+    return tuple(derivs)
+
+def euler_deconv(data,xi,yi,zi,shape,area,SI,windowSize,filt,workers=None,
+                 stats=None,dtype=None,mask=None):
+    """
+    euler_python.euler_deconv, read from the cache when the same estimates
+    were computed before - see euler_deconv_multi.
+
+    Returns:
+
+    * classic_est : 2d-array
+        x, y, z and base-level best estimates kept after select a percentage
+    """
+    return euler_deconv_multi(data,xi,yi,zi,shape,area,[SI],windowSize,
+                              filt,workers,stats,dtype,mask)[0]
+
+def euler_deconv_multi(data,xi,yi,zi,shape,area,SI_vet,windowSize,filt,
+                       workers=None,stats=None,dtype=None,mask=None):
+    """
+    euler_python.euler_deconv_multi with the estimates of each SI and the
+    derivatives read from the cache. Only the SIs that are not in the
+    cache are solved, with the cached derivatives if they are there. The
+    counters 'cache_hits' and 'cache_misses' of stats count the results
+    read and not found.
+
+    Returns:
+
+    * est_classic : list of 2d-array
+        x, y, z and base-level best estimates kept after select a
+        percentage, one array for each SI in SI_vet
+    """
+    params=_params(shape,area,dtype,None,None)
+    params.update(windowSize=int(windowSize),filt=float(filt))
+    # the grids are hashed once for all the SIs
+    grids=_digest([data,xi,yi,zi,mask])
+    keys=[_key('euler',grids,dict(params,SI=float(SI))) for SI in SI_vet]
+    est_classic=[]
+    for key in keys:
+        est=_read(key,stats)
+        est_classic.append(None if est is None else est[0])
+    missing=[k for k,est in enumerate(est_classic) if est is None]
+    if missing:
+        derivs=deriv(data,shape,area,stats,dtype=dtype)
+        est_vet=euler.euler_deconv_multi(data,xi,yi,zi,shape,area,
+                                         [SI_vet[k] for k in missing],
+                                         windowSize,filt,workers,stats,dtype,
+                                         mask,derivs=derivs)
+        for k,est in zip(missing,est_vet):
+            _write(keys[k],[est])
+            est_classic[k]=est
+    return est_classic
@@ -0,0 +1,235 @@
+"""
+Solution store
+
+A Python program to keep the solutions of all the moving data windows of
+Euler deconvolution in a folder of the disk, so the reliable estimates can
+be selected again for other percentages, areas or structural indices
+without computing the derivatives and solving the systems again.
+
+The store is columnar: each field is a .npy file that is memory-mapped
+when the store is opened, so a query reads only the fields and the
+windows it needs:
+    - 'store.json': the shape, area, window size, SIs, precision and the
+      criterion of the selection
+    - 'stdz.npy': the standard deviation of the z derivative of each window
+    - 'rank.npy': the windows solved, from the largest to the smallest
+      score of the criterion (the standard deviation of the z derivative
+      by default) - the estimates kept for a percentage filt are the first
+      int(len(rank)*filt) windows of this list. With a criterion that
+      depends on the SI (the depth error), one file 'rank_SI_X.npy' for
+      each structural index X
+    - 'SI_X.npy': the x, y, z and base-level estimates of the structural
+      index X, one row for each field (x, y, z and base level)
+The windows are numbered by their position in the grid, without the
+border of the grid, as in euler_python.select_estimates.
+
+This code is released from the paper:
+Reliable Euler deconvolution estimates throughout the
+vertical derivatives of the total-field anomaly
+
+The program is under the conditions terms in the file README.txt
+
+authors: Felipe F. Melo and Valeria C.F. Barbosa, 2019
+email: felipe146@hotmail.com, valcris@on.br
+"""
+
+import json
+import os
+import numpy as np
+
+def _si_name(SI):
+    return 'SI_%g.npy' % SI
+
+def _rank_name(SI=None):
+    return 'rank.npy' if SI is None else 'rank_SI_%g.npy' % SI
+
+def write_store(folder,est_vet,stdz,shape,area,SI_vet,windowSize,
+                windows=None,score=None,criterion='stdz'):
+    """
+    Save the solutions of all the windows in a solution store.
+
+    Parameters:
+
+    * folder : str
+        folder of the store, created if it does not exist
+    * est_vet : list of 3d-array
+        x, y, z and base-level estimates of each window, one for each SI -
+        see euler_python.solve_windows
+    * stdz : 2d-array
+        standard deviation of the z derivative in each window
+    * shape : tuple = (nx, ny)
+        the shape of the grid
+    * area : list
+        the area of the input data - [south, north, west, east]
+    * SI_vet : list
+        structural indices of est_vet
+    * windowSize : int
+        size of the window - equal in both directions
+    * windows : 2d-array
+        True at the windows solved - see euler_python.solve_windows.
+        Default: all the windows
+    * score : 2d-array or list of 2d-array
+        score of the selection of each window, the largest first - see
+        euler_python.criterion_score. A list has one score for each SI.
+        Default: stdz
+    * criterion : str or list
+        the criterion of score, saved in the header
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    delta=windowSize//2
+    # windows centred inside the border of the grid
+    ny,nx=shape[0]-2*delta,shape[1]-2*delta
+    stdzmat=np.ascontiguousarray(stdz[:ny,:nx]).ravel()
+    if windows is None:
+        solved=np.arange(len(stdzmat))
+    else:
+        solved=np.flatnonzero(np.ravel(windows[:ny,:nx]))
+    if score is None:
+        score=stdz
+    per_si=isinstance(score,(list,tuple))
+    itype=np.int32 if len(stdzmat) < 2**31 else np.int64
+    for SI,sc in zip(SI_vet,score) if per_si else [(None,score)]:
+        sc=np.ravel(np.asarray(sc)[:ny,:nx])
+        # stable sort: the windows with the same score keep their order in
+        # the grid, as in euler_python.reliable_order
+        rank=solved[np.argsort(-sc[solved],kind='stable')]
+        np.save(os.path.join(folder,_rank_name(SI)),rank.astype(itype))
+    np.save(os.path.join(folder,'stdz.npy'),stdzmat)
+    for SI,est in zip(SI_vet,est_vet):
+        columns=np.ascontiguousarray(est[:ny,:nx].reshape(-1,4).T)
+        np.save(os.path.join(folder,_si_name(SI)),columns)
+    header={'version':1, 'shape':[int(n) for n in shape],
+            'area':[float(a) for a in area], 'windowSize':int(windowSize),
+            'SI':[float(SI) for SI in SI_vet], 'dtype':stdzmat.dtype.name,
+            'windows':int(len(stdzmat)), 'solved':int(len(rank)),
+            'criterion':criterion, 'rank_per_SI':per_si}
+    with open(os.path.join(folder,'store.json'),'w') as fid:
+        json.dump(header,fid,indent=1)
+
+class SolutionStore(object):
+    """
+    A solution store opened for queries. The fields are memory-mapped and
+    read from the disk only when a query uses them.
+
+    Parameters:
+
+    * folder : str
+        folder of the store - see write_store
+
+    Attributes:
+
+    * shape, area, windowSize, SI_vet, criterion :
+        the grid and the parameters of the solutions
+    """
+    def __init__(self,folder):
+        with open(os.path.join(folder,'store.json')) as fid:
+            header=json.load(fid)
+        self.folder=folder
+        self.shape=tuple(header['shape'])
+        self.area=header['area']
+        self.windowSize=header['windowSize']
+        self.SI_vet=header['SI']
+        self.criterion=header.get('criterion','stdz')
+        self.stdz=self._load('stdz.npy')
+        if header.get('rank_per_SI',False):
+            self.rank=None
+            self._ranks=dict((SI,self._load(_rank_name(SI)))
+                             for SI in self.SI_vet)
+        else:
+            self.rank=self._load('rank.npy')
+        self._columns={}
+
+    def _load(self,name):
+        return np.load(os.path.join(self.folder,name),mmap_mode='r')
+
+    def columns(self,SI):
+        """
+        x, y, z and base-level estimates of all the windows for one SI, one
+        row for each field. The estimates of the windows not solved are
+        NaN.
+
+        Parameters:
+
+        * SI : float
+            structural index, one of SI_vet
+
+        Returns:
+
+        * columns : 2d-array
+            memory-mapped estimates, with shape (4, number of windows)
+        """
+        if SI not in self.SI_vet:
+            raise ValueError("the store has no solutions of the SI %g" % SI)
+        if SI not in self._columns:
+            self._columns[SI]=self._load(_si_name(SI))
+        return self._columns[SI]
+
+    def selected(self,filt,SI=None):
+        """
+        Windows of the estimates kept for a percentage, from the largest to
+        the smallest score of the criterion of the store.
+
+        Parameters:
+
+        * filt : float
+            percentage of the solutions that will be keep
+        * SI : float
+            structural index, needed if the criterion depends on the SI
+            (the depth error)
+
+        Returns:
+
+        * index : 1d-array
+            position of the windows in the grid, without the border
+        """
+        rank=self.rank
+        if rank is None:
+            if SI not in self._ranks:
+                raise ValueError("the selection of the criterion %s depends "
+                                 "on the SI, give one of %s" %
+                                 (self.criterion,self.SI_vet))
+            rank=self._ranks[SI]
+        return np.asarray(rank[:int(len(rank)*filt)])
+
+    def select(self,filt,SI=None,area=None):
+        """
+        Select the reliable estimates again - the same estimates of
+        euler_python.euler_deconv_multi with the percentage filt and the
+        criterion of the store.
+
+        Parameters:
+
+        * filt : float
+            percentage of the solutions that will be keep
+        * SI : float or list
+            structural index or indices of the estimates. Default: all the
+            SIs of the store
+        * area : list
+            keep only the estimates inside the rectangle [south, north,
+            west, east]. Estimates on its edges are outside of it. Default:
+            all the estimates kept
+
+        Returns:
+
+        * est_classic : 2d-array or list of 2d-array
+            x, y, z and base-level best estimates kept after select a
+            percentage - a list with one array for each SI if SI is a list
+            or None
+        """
+        if SI is None or np.ndim(SI) > 0:
+            SIs=self.SI_vet if SI is None else SI
+            return [self.select(filt,si,area) for si in SIs]
+        columns=self.columns(SI)
+        index=self.selected(filt,SI)
+        # read the windows in the order of the file and restore the order
+        # of the selection
+        order=np.argsort(index,kind='stable')
+        est=np.empty((len(index),4),dtype=columns.dtype)
+        est[order]=columns[:,index[order]].T
+        if area is not None:
+            x,y=est[:,0],est[:,1]
+            inside=((x > area[0]) & (x < area[1]) &
+                    (y > area[2]) & (y < area[3]))
+            est=est[inside]
+        return est
@@ -20,6 +20,8 @@ Input:
 input/synthetic_data.dat - 2d-array with "n" rows by 4 columns: 
     x-coordinate, y-coordinate, z-coordinate, anomaly. Where "n" rows
     correspond to the size of the data.
+    It is converted to the binary grid file input/synthetic_data.grd in
+    the first run (see grid_io.py).
 
 Parameters:
 
@@ -40,21 +42,24 @@ The areas to compute the statistics about the mean of the northing,
 easting and depth estimates:
     area_cla  - array defining the four vertices of a polygon 
                 [south,north,west,east]
+
+The clusters of the estimates and the SI of each source are saved in
+results/classic_clusters*.txt (see estimates_clustering.py).
 """
 
+import os
 import numpy as np
 import plot_functions as plt_fc
-import euler_python as euler
 import estimates_statistics as est_stats
+import estimates_clustering as est_clust
+import grid_io
+import result_cache
 
-# Input data
-data_input=np.loadtxt('input/synthetic_data.dat')
-shape = (120, 140)
-area = [0, 24000, 0, 28000]
-xi=data_input[:,0]
-yi=data_input[:,1]
-zi=data_input[:,2]
-data=data_input[:,3]
+# Input data - converted once to a binary grid file, that is memory-mapped
+# with the shape and area of the grid
+if not os.path.exists('input/synthetic_data.grd'):
+    grid_io.dat_to_grid('input/synthetic_data.dat','input/synthetic_data.grd')
+data,xi,yi,zi,shape,area=grid_io.load_grid('input/synthetic_data.grd')
 
 '''
 Plot input data - Figure 2d
@@ -68,17 +73,16 @@ window size and the percentage of solutions to keep
 winsize=7
 #percentage of the solutions that will be keep
 filt=0.1
-#empty array for multiple SIs
-est_classic=[]
 #Define below the SIs to be tested
 SI_vet=[0.001,1,2,3]
 '''
-Euler deconvolution for multiple SIs
+Euler deconvolution for multiple SIs - the derivatives and window sums
+are shared by all the SIs. The estimates are kept in the folder 'cache'
+(see result_cache.py): running again with the same data and parameters
+reads them instead of computing them again
 '''
-for SI in (SI_vet):
-    classic = euler.euler_deconv(data,xi,yi,zi,shape,area,SI,winsize,
-                                       filt)
-    est_classic.append(classic)     
+est_classic = result_cache.euler_deconv_multi(data,xi,yi,zi,shape,area,
+                                              SI_vet,winsize,filt)
 #Here finishes Euler deconvolution 
 '''
 Plot Figures 4 and 7 - Selected depth and base level estimates for all SIs
@@ -98,6 +102,15 @@ est_stats.classic(est_classic,area_cla1,SI_vet,'classic_plt1')
 est_stats.classic(est_classic,area_cla2,SI_vet,'classic_plt2')
 est_stats.classic(est_classic,area_cla3,SI_vet,'classic_plt3')
 
+#statistics of all the areas and SIs in one pass, saved in one file
+est_stats.classic_areas(est_classic,[area_cla0,area_cla1,area_cla2,area_cla3],
+                        SI_vet,'classic_areas')
+'''
+Clusters of the estimates and ranking of the SIs by the tightness of the
+clusters - cells of 1 km with at least 5 estimates
+'''
+est_clust.classic_clusters(est_classic,SI_vet,1000.,5,'classic_clusters')
+
 
 """
 To save the estimates in a txt file: